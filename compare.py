@@ -8,8 +8,8 @@ Directory content compare tool.
 
 import argparse
 import logging
-from typing import Union, List
-from os.path import isdir, isfile, splitext, split, join, sep
+from typing import List, Iterable, Tuple
+from os.path import isdir, isfile, getsize, splitext, split, join, dirname
 
 from tools import ProgressBar, Config
 
@@ -20,11 +20,15 @@ CONSTANTS
 """
 
 DESCRIPTION = \
-    "Directory content compare tool."
+    "Directory content compare tool.\n" \
+    "Run with `python3 -O` on large listings to skip runtime type assertions."
 
 
 CONFIG_VERSION = 0.1  # must specify minimal configuration file version here
 
+MIN_READ_BUFFER_SIZE = 1 << 16  # 64 KiB, well above default ~8 KiB io buffer
+MAX_READ_BUFFER_SIZE = 1 << 20  # 1 MiB, for large `ls -lR` listings
+
 DEFAULT_CFG = \
     f"# extract.py configuration file.\n" \
     f"# use # to mark comments.  Note # has to be first character in line.\n" \
@@ -42,6 +46,7 @@ DEFAULT_CFG = \
     f"# further configurations #\n" \
     f"##########################\n" \
     f"\n" \
+    f"# listings are parsed sequentially either way, parallel parsing measured slower\n" \
     f"multiprocessing = no\n" \
     f"# multiprocessing = yes"
 
@@ -76,6 +81,7 @@ class PathParser:
     """
 
     _base_path = None
+    _base_len = 0
 
     def __init__(self) -> None:
         """
@@ -89,10 +95,10 @@ class PathParser:
         logging.debug(f'{str(self.__class__.__name__)} destructor completed.')
 
     def parse(self, path: str) -> str:
-        assert isinstance(path, str)
         if self._base_path is None:  # not set yet
-            self._base_path = sep.join(split(path)[:-1]).lstrip('/')  # assumes first time run will indicate base path
-        return path[len(self._base_path) + 1:]  # skip base path as not relevant for comparison
+            self._base_path = dirname(path).lstrip('/')  # assumes first time run will indicate base path
+            self._base_len = len(self._base_path) + 1
+        return path[self._base_len:]  # skip base path as not relevant for comparison
 
 
 """
@@ -107,9 +113,6 @@ class Comparer:
     Argument parsing and default value population (from config).
     """
 
-    paths = list()
-    dest = ''
-
     def __init__(self,
                  paths: List[str],
                  dest: str) -> None:
@@ -118,6 +121,7 @@ class Comparer:
         """
         _ = logging.getLogger(self.__class__.__name__)
 
+        self.paths = []
         assert isinstance(dest, str)
         self.dest = dest
 
@@ -146,105 +150,100 @@ class Comparer:
         # destructor content here if required
         logging.debug(f'{str(self.__class__.__name__)} destructor completed.')
 
-    def read_files(self, paths: List[str]) -> List[List[str]]:
-        assert isinstance(paths, list)
-        assert all(isinstance(x, str) for x in paths)
-        assert all(isfile(x) for x in paths)
-
-        # read files
-        file_lines = list()
-        p = ProgressBar('read', len(self.paths))
-        for path in paths:
-            with open(path) as file:
-                file_content = file.readlines()
-                assert isinstance(file_content, list)
-                assert all(isinstance(x, str) for x in file_content)
-                logging.debug(f'file {split(path)[1]} read, {len(file_content)}')
-                file_lines.append(file_content)
-                p.next()
-        p.finish()
-        return file_lines
-
-    @staticmethod
-    def does_line_start_or_end_with_strings(line: str,
-                                            start_strings: Union[None, str, List[str]] = None,
-                                            end_strings: Union[None, str, List[str]] = None) -> bool:
-        assert isinstance(line, str)
-        if start_strings is None:
-            start_strings = []  # default skip checking
-        if isinstance(start_strings, str):
-            start_strings = [start_strings]
-        assert isinstance(start_strings, list)
-        assert all(isinstance(x, str) for x in start_strings)
-        if end_strings is None:
-            end_strings = []  # default skip checking
-        if isinstance(end_strings, str):
-            end_strings = [end_strings]
-        assert isinstance(end_strings, list)
-        assert all(isinstance(x, str) for x in end_strings)
-        return any(line.startswith(x) for x in start_strings) or any(line.endswith(x) for x in end_strings)
-
-    def parse(self, lines: List[str]) -> dict:
-        assert isinstance(lines, list)
-        assert all(isinstance(line, str) for line in lines)
+    def parse(self, lines: Iterable[str]) -> dict:
+        assert isinstance(lines, Iterable)
         logging.debug('parsing file')
-        folder_path = ''
         file_content = dict()
-        path_parser = PathParser()  # reset base_path for each file
-        for line in lines:
+        folder_files = []  # lines before first folder header are not kept
+        path_parser_parse = PathParser().parse  # reset base_path for each file, bound once for the loop
+        for line in lines:  # any iterable of lines, e.g. file object, consumed one line at a time
             line = line.rstrip()
-            if self.does_line_start_or_end_with_strings(line, start_strings=['.', '/'], end_strings=':'):
-                folder_path = path_parser.parse(line.rstrip('/').rstrip(':'))
-                if folder_path not in file_content.keys():  # folder already found
-                    file_content[folder_path] = list()  # create folder path key in file_content
-            elif not self.does_line_start_or_end_with_strings(line, start_strings='total'):
+            if line.startswith(('.', '/')) or line.endswith(':'):  # folder header line
+                folder_path = path_parser_parse(line.rstrip('/').rstrip(':'))
+                folder_files = file_content.setdefault(folder_path, [])  # create folder path key if not found
+            elif not line.startswith('total'):
                 file_name = line.lstrip('/').rstrip('/').split(' ')[-1]
                 # file_size = 0
                 # try:
                 #     file_size = int(line.lstrip('/').rstrip('/').split(' ')[4])
                 # except ValueError:
                 #     logging.warning(f"unable to parse file size from line: {line}")
-                file_content[folder_path].append(file_name)
+                folder_files.append(file_name)
         return file_content
 
+    def parse_file(self, path: str) -> dict:
+        assert isinstance(path, str)
+        buffer_size = min(max(getsize(path), MIN_READ_BUFFER_SIZE), MAX_READ_BUFFER_SIZE)
+        with open(path, buffering=buffer_size) as file:  # lines parsed as read, never held in a list
+            return self.parse(file)
+
     @staticmethod
-    def find_mismatched_left(left: dict, right: dict) -> List[str]:
+    def _normalize(file_content: dict) -> dict:
+        """
+        Normalise parsed file content for case insensitive comparison.
+        @param file_content: folder path to file names dict, as returned by parse
+        @return: normalised folder path to list of frozenset of file names dict,
+                 folders differing only by case (case sensitive file systems) share the same list
+        """
+        assert isinstance(file_content, dict)
+        lower, lstrip = str.lower, str.lstrip  # bound once, skips per-key method lookup
+        normalized = dict()
+        for k, v in file_content.items():
+            normalized.setdefault(lower(lstrip(k, '/')), []).append(frozenset(v))
+        return normalized
+
+    @staticmethod
+    def find_mismatched(left: dict, right: dict) -> Tuple[List[str], List[str]]:
+        """
+        Find files missing from the same folder (case insensitive) on the other side, both directions.
+        @param left: folder path to file names dict, as returned by parse
+        @param right: folder path to file names dict, as returned by parse
+        @return: tuple of (files in left missing from right, files in right missing from left) path lines,
+                 each in its own listing order
+        """
         assert isinstance(left, dict)
         assert isinstance(right, dict)
-        mismatched = []
-        progress_bar = ProgressBar('comparing', len(left) * len(right))
-        for left_key in left.keys():  # left directories
-            for right_key in right.keys():  # right directories
-                if left_key.lstrip('/').lower() == right_key.lstrip('/').lower():  # case insensitive
-                    left_filenames = left[left_key]
-                    right_filenames = right[right_key]
-                    for left_filename in left_filenames:
-                        if left_filename not in right_filenames:
-                            mismatched.append(f"{left_key.lstrip('/')}/{left_filename.lstrip('/')}\n")
-                        # TODO: compare file sizes here
-                progress_bar.next()
+        left_mismatched = []
+        right_mismatched = []
+        lower, lstrip = str.lower, str.lstrip  # bound once, skips per-folder and per-file method lookup
+        left_normalized = Comparer._normalize(left)  # case folded once per listing, not per folder pair
+        right_normalized = Comparer._normalize(right)
+        both = len(left_normalized.keys() & right_normalized.keys())  # folders found on both sides
+        logging.info(f"{len(left_normalized) - both} folders only in left, "
+                     f"{len(right_normalized) - both} folders only in right")
+        progress_bar = ProgressBar('comparing', max(len(left) + len(right), 1))
+        progress_step = max(1, (len(left) + len(right)) // 1000)  # at most ~1000 progress bar updates
+        for content, other_normalized, mismatched in ((left, right_normalized, left_mismatched),
+                                                      (right, left_normalized, right_mismatched)):
+            for count, (key, filenames) in enumerate(content.items(), 1):  # folders in listing order
+                other_filenames_sets = other_normalized.get(lower(lstrip(key, '/')))
+                if other_filenames_sets is not None:  # same folder found on the other side
+                    prefix = lstrip(key, '/') + '/'  # folder part formatted once per folder
+                    for other_filenames in other_filenames_sets:
+                        mismatched += [prefix + lstrip(filename, '/') + '\n'
+                                       for filename in filenames if filename not in other_filenames]
+                    # TODO: compare file sizes here
+                if count % progress_step == 0:
+                    progress_bar.next(progress_step)
         progress_bar.finish()
-        logging.info(f"found {len(mismatched)} files")
-        return mismatched
+        logging.info(f"found {len(left_mismatched)} left files and {len(right_mismatched)} right files missing")
+        return left_mismatched, right_mismatched
 
     def compare(self):
         """
         Main program.
         """
-        files_lines = self.read_files(self.paths)
         left_mismatched = list()
         right_mismatched = list()
         # parse files
-        p = ProgressBar('parse', len(files_lines))
-        len_files = len(files_lines)
+        p = ProgressBar('parse', len(self.paths))
         files_contents = list()
-        for i in range(len_files):
-            files_contents.append(self.parse(files_lines[i]))
+        for path in self.paths:  # sequential, returning parsed dicts from worker processes costs more than it saves
+            files_contents.append(self.parse_file(path))
             p.next()
         p.finish()
         # compare
-        left_mismatched_lines = self.find_mismatched_left(files_contents[0], files_contents[1])
-        right_mismatched_lines = self.find_mismatched_left(files_contents[1], files_contents[0])
+        left_mismatched_lines, right_mismatched_lines = self.find_mismatched(*files_contents)
         # clean `d` directory lines - request by Phil
         for left_mismatched_line in left_mismatched_lines:
             if ~left_mismatched_line.lower().startswith('d'):
@@ -255,10 +254,10 @@ class Comparer:
         # write results
         p = ProgressBar('write', 2)
         with open(join(self.dest, f"missing_{splitext(split(self.paths[0])[1])[0]}.txt"), 'wt') as f:
-            f.writelines(left_mismatched)
+            f.write(''.join(left_mismatched))  # single write call
         p.next()
         with open(join(self.dest, f"missing_{splitext(split(self.paths[1])[1])[0]}.txt"), 'wt') as f:
-            f.writelines(right_mismatched)
+            f.write(''.join(right_mismatched))  # single write call
         p.finish()
 
 
@@ -274,9 +273,6 @@ class ArgumentsAndConfigProcessing:
     Argument parsing and default value population (from config).
     """
 
-    paths = list()
-    dest = ''
-
     def __init__(self, config_file_path: str,
                  left: str = '',
                  right: str = '',
@@ -286,6 +282,9 @@ class ArgumentsAndConfigProcessing:
         """
         _ = logging.getLogger(self.__class__.__name__)
 
+        self.paths = []
+        self.dest = ''
+
         assert isinstance(config_file_path, str)
         config = Config(CONFIG_VERSION, config_file_path, DEFAULT_CFG)
 
@@ -7,12 +7,30 @@ tools.
 """
 
 import logging
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from json import dump, load
-from os.path import isdir, isfile, split
-from typing import Union
+from os import stat, stat_result
+from os.path import isfile, split
+from stat import S_ISDIR, S_ISREG
+from time import monotonic_ns
+from typing import Union, List, Mapping, Tuple
 
 from pandas import DataFrame, Series
+from pandas.api.types import infer_dtype, is_datetime64_any_dtype
+
+try:  # optional faster JSON parser, stdlib json used if not installed
+    import orjson
+except ImportError:
+    orjson = None
+
+try:  # optional lazy JSON parser, see read_json_file_lazy
+    import simdjson
+except ImportError:
+    simdjson = None
 
 """
 =========
@@ -45,6 +63,20 @@ DEFAULT_CFG = \
     f"# index_col = yes\n" \
     f"index_col = no"
 
+CONFIG_LINE_REGEX = re.compile(r'[ \t]*([^#\s=][^=]*?)[ \t]*=[ \t]*(.*?)[ \t\r]*')  # name = value, fullmatch
+
+_DIGITS = r'\d(?:_?\d)*'
+_SPACES = r'[^\S\x1c-\x1f]*'  # whitespace stripped by float(), which unlike \s excludes \x1c-\x1f
+NUMBER_REGEX = re.compile(rf'{_SPACES}[-+]?(?:(?:{_DIGITS}(?:\.(?:{_DIGITS})?)?|\.{_DIGITS})(?:e[-+]?{_DIGITS})?'
+                          rf'|inf(?:inity)?|nan){_SPACES}\Z', re.IGNORECASE)  # strings accepted by float()
+
+JSON_LONG_DIGITS_REGEX = re.compile(rb'\d{19}')  # possibly beyond 64 bit integers, left to stdlib json
+
+DID_MAP_MAX_UNIQUE_RATIO = 0.1  # convert distinct DIDs and map back only below this share of distinct values
+DID_SAMPLE_SIZE = 10000  # DIDs sampled to rule out mostly distinct columns before the full unique()
+DID_SAMPLE_MAX_UNIQUE_RATIO = 0.9  # share of distinct DIDs in the sample above which mapping is not tried
+MAX_READ_THREADS = 8  # maximal number of files read concurrently by read_files_batch
+
 DEFAULT_CREDENTIALS = {
     "username": "<your_username_here>",
     "password": "<your_password_here>"
@@ -84,7 +116,6 @@ FUNCTIONS
 
 
 def is_number(string_value: str) -> bool:
-    assert isinstance(string_value, str)
     try:
         float(string_value)
         return True
@@ -92,15 +123,25 @@ def is_number(string_value: str) -> bool:
         return False
 
 
+def is_number_series(string_values: Series) -> Series:
+    assert isinstance(string_values, Series)
+    return string_values.str.match(NUMBER_REGEX.pattern, flags=NUMBER_REGEX.flags)
+
+
 def read_txt_file(path_to_file: str) -> Union[None, str]:
     assert isinstance(path_to_file, str)
     content = None
     if isfile(path_to_file):
-        with open(path_to_file, 'rt') as txt_file:
-            content = txt_file.read()
-        # validate content
-        if not isinstance(content, str):
-            logging.error(f"invalid content in file {split(path_to_file)[1]}")
+        content = _read_existing_txt_file(path_to_file)
+    return content
+
+
+def _read_existing_txt_file(path_to_file: str) -> str:
+    with open(path_to_file, 'rt') as txt_file:
+        content = txt_file.read()
+    # validate content
+    if not isinstance(content, str):
+        logging.error(f"invalid content in file {split(path_to_file)[1]}")
     return content
 
 
@@ -117,10 +158,51 @@ def read_json_file(path_to_file: str) -> Union[None, dict]:
     assert isinstance(path_to_file, str)
     content = None
     if isfile(path_to_file):
-        with open(path_to_file) as credentials_file:
-            content = load(credentials_file)
+        content = _read_existing_json_file(path_to_file)
+    return content
+
+
+def _read_existing_json_file(path_to_file: str) -> Union[None, dict]:
+    content = _load_json_file(path_to_file)
+    # validate content
+    if not isinstance(content, dict):
+        logging.error(f"invalid content in file {split(path_to_file)[1]}")
+    return content
+
+
+def _load_json_file(path_to_file: str):
+    if orjson is not None:
+        with open(path_to_file, 'rb') as json_file:
+            raw = json_file.read()
+        if JSON_LONG_DIGITS_REGEX.search(raw) is None:  # some orjson versions silently turn big integers to float
+            try:
+                return orjson.loads(raw)
+            except orjson.JSONDecodeError:  # e.g. NaN or Infinity written by json.dump, retry below
+                pass
+    with open(path_to_file) as credentials_file:
+        return load(credentials_file)
+
+
+EXISTING_FILE_READERS = {  # file reader -> equivalent skipping isfile check
+    read_txt_file: _read_existing_txt_file,
+    read_json_file: _read_existing_json_file,
+}
+
+
+def read_json_file_lazy(path_to_file: str) -> Union[None, Mapping]:
+    """
+    Read JSON file, materialising fields only on access when simdjson installed (e.g. content['username']).
+    Same as read_json_file otherwise.
+    """
+    assert isinstance(path_to_file, str)
+    if simdjson is None:
+        return read_json_file(path_to_file)
+    content = None
+    if isfile(path_to_file):
+        with open(path_to_file, 'rb') as json_file:
+            content = simdjson.Parser().parse(json_file.read())  # parser per call, documents bound to their parser
         # validate content
-        if not isinstance(content, dict):
+        if not isinstance(content, simdjson.Object):
             logging.error(f"invalid content in file {split(path_to_file)[1]}")
     return content
 
@@ -131,24 +213,58 @@ def write_json_file(path_to_file: str, content: Union[None, dict]):
         assert isinstance(content, dict)
         with open(path_to_file, 'w') as file:
             dump(content, file)
-            logging.debug(f"{split(path_to_file)[1]} file written")
+        logging.debug(f"{split(path_to_file)[1]} file written")
 
 
 def convert_vehicle_did_to_imei(vehicle_system_did: str) -> int:
-    assert isinstance(vehicle_system_did, str)
     return int(vehicle_system_did.replace('A', '').replace('-', ''))
 
 
+def convert_vehicle_did_series_to_imei(vehicle_system_dids: Series) -> Series:
+    assert isinstance(vehicle_system_dids, Series)
+    sample = vehicle_system_dids.sample(min(len(vehicle_system_dids), DID_SAMPLE_SIZE), random_state=0)
+    if sample.nunique() > len(sample) * DID_SAMPLE_MAX_UNIQUE_RATIO:  # mostly distinct, skip full unique() below
+        return vehicle_system_dids.apply(convert_vehicle_did_to_imei)
+    unique_dids = vehicle_system_dids.unique()
+    if len(unique_dids) > len(vehicle_system_dids) * DID_MAP_MAX_UNIQUE_RATIO:  # mapping costs more
+        return vehicle_system_dids.apply(convert_vehicle_did_to_imei)
+    # same vehicle repeats across many events, convert each distinct DID once and map back
+    return vehicle_system_dids.map({did: convert_vehicle_did_to_imei(did) for did in unique_dids})
+
+
 def format_date_field_for_rms(time_field: datetime) -> str:
-    assert isinstance(time_field, datetime)
-    return time_field.strftime("%Y%m%d%H%M%S")
+    # equivalent of strftime("%Y%m%d%H%M%S") without locale aware libc formatting
+    return f"{time_field.year:04d}{time_field.month:02d}{time_field.day:02d}" \
+           f"{time_field.hour:02d}{time_field.minute:02d}{time_field.second:02d}"
+
+
+def format_datetime_series_for_rms(time_fields: Series) -> Series:
+    assert isinstance(time_fields, Series)
+    # YYYYmmddHHMMSS assembled as one int64 per row, then converted to zero padded string
+    t = time_fields.dt
+    digits = t.year.astype('int64') * 10 ** 10 + t.month * 10 ** 8 + t.day * 10 ** 6 + t.hour * 10 ** 4 + \
+        t.minute * 100 + t.second  # int64, whole datetime does not fit in int32 date field dtype
+    return digits.astype(str).str.zfill(14)
+
+
+def is_string_column(column: Series) -> bool:
+    # .str based equivalents differ from per row scalar call on missing or non string values,
+    # str/string dtype columns report 'string' even when holding NaN/NA
+    return infer_dtype(column, skipna=False) == 'string' and not column.isna().any()
+
+
+VECTORISED_FUNCTIONS = {  # scalar function -> (column dtype check, whole column equivalent)
+    convert_vehicle_did_to_imei: (is_string_column, convert_vehicle_did_series_to_imei),
+    format_date_field_for_rms: (is_datetime64_any_dtype, format_datetime_series_for_rms),
+}
 
 
 def apply_function_to_column(df: DataFrame, col: str, func) -> Series:
-    assert isinstance(df, DataFrame)
-    assert isinstance(col, str)
-    assert col in df.columns
-    return df.loc[:, col].apply(func)
+    column = df.loc[:, col]
+    dtype_check, vectorised_func = VECTORISED_FUNCTIONS.get(func, (None, None))
+    if vectorised_func is not None and (dtype_check is None or dtype_check(column)):
+        return vectorised_func(column)  # vectorised equivalent available, skip per row python call
+    return column.apply(func)
 
 
 def read_file(path_to_file: str, default_content: Union[None, str, dict],
@@ -162,9 +278,10 @@ def read_file(path_to_file: str, default_content: Union[None, str, dict],
     assert isinstance(expected_extension, str)
     expected_extension = expected_extension.lower()
     assert isinstance(always_generate_new_file, bool)
-    if isdir(path_to_file):
+    path_type, _ = classify_path(path_to_file)  # single stat call drives all checks and the read below
+    if path_type == 'dir':
         logging.error(f"path {path_to_file} should point to a file, not a directory")
-    elif always_generate_new_file or not isfile(path_to_file):  # file doesn't exist, try to write default content
+    elif always_generate_new_file or path_type != 'file':  # file doesn't exist, try to write default content
         if default_content is not None:
             file_writer_function(path_to_file, default_content)
             logging.info(f"{path_to_file} does not exist, writing default content")
@@ -174,10 +291,31 @@ def read_file(path_to_file: str, default_content: Union[None, str, dict],
         if not path_to_file.lower().endswith(expected_extension):
             logging.warning(f"{split(path_to_file)[1]} file extension expected to be .{expected_extension}")
         else:
-            content = file_reader_function(path_to_file)  # read file
+            existing_file_reader = EXISTING_FILE_READERS.get(file_reader_function)
+            if existing_file_reader is not None:  # already known to be a file
+                content = existing_file_reader(path_to_file)  # read file, no further stat calls
+            else:
+                content = file_reader_function(path_to_file)  # read file
     return content
 
 
+def classify_path(path: str) -> Tuple[str, Union[None, stat_result]]:
+    """
+    Classify path with a single stat call, replacing separate isdir and isfile calls.
+    @return: ('dir', 'file' or 'none', stat result or None if path does not exist)
+    """
+    assert isinstance(path, str)
+    try:
+        path_stat = stat(path)
+    except (OSError, ValueError):  # same failures isfile and isdir treat as not existing
+        return 'none', None
+    if S_ISDIR(path_stat.st_mode):
+        return 'dir', path_stat
+    if S_ISREG(path_stat.st_mode):
+        return 'file', path_stat
+    return 'none', path_stat
+
+
 def read_parameter_file(path_to_file: str,
                         default_content: Union[None, dict],
                         always_generate_new_file: bool = False) -> Union[None, dict]:
@@ -190,6 +328,36 @@ def read_query_file(path_to_file: str,
     return read_file(path_to_file, default_content, read_txt_file, write_txt_file, "txt", always_generate_new_file)
 
 
+def read_files_batch(file_specs: List[tuple]) -> list:
+    """
+    Read several files concurrently, hiding per file open/read latency (e.g. network drives).
+    read_file keeps no module level state, so it is safe to run in several threads.
+    @param file_specs: list of read_file positional argument tuples, e.g.
+                       (path_to_file, default_content, file_reader_function, file_writer_function, 'json')
+    @return: list of file contents, in file_specs order
+    """
+    assert isinstance(file_specs, list)
+    assert all(isinstance(x, tuple) for x in file_specs)
+    if len(file_specs) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(file_specs), MAX_READ_THREADS)) as pool:
+        return list(pool.map(lambda file_spec: read_file(*file_spec), file_specs))
+
+
+@contextmanager
+def _safe_open(path: str, mode: str):
+    """
+    open() context, logging and re-raising file access errors raised while opening or using the file.
+    """
+    try:
+        with open(path, mode) as file:
+            yield file
+    except OSError as e:  # includes PermissionError, re-raised as the same type
+        msg = f"can not access file {path}. Might be opened by another application. Error returned: {e}"
+        logging.error(msg)
+        raise type(e)(msg) from e
+
+
 """
 ==================
 CONFIG FILE PARSER
@@ -203,8 +371,6 @@ class Config:
     Note all return values in string format.
     """
 
-    _config = {}
-
     def __init__(self, config_version: float, path: Union[None, str] = None, default_cfg: str = DEFAULT_CFG):
         """
         Initialisations
@@ -214,8 +380,10 @@ class Config:
         """
 
         self.log = logging.getLogger(self.__class__.__name__)
+        self._config = {}
         assert isinstance(config_version, float)
         assert isinstance(default_cfg, str)
+        content = None
         if path is None:
             path = f'./{self.__class__.__name__}.cfg'
             logging.debug(f'Path to configuration file not specified.  Using: {path}')
@@ -225,59 +393,27 @@ class Config:
                 logging.debug(f'Configuration file detected as {path}')
             else:
                 logging.debug(f"Configuration file path specified {path} does not exist, creating default")
-                try:
-                    with open(path, 'wt') as config_file:
-                        config_file.write(default_cfg)
-                    config_file.close()
-                    logging.debug(f'{path} file created')
-                except PermissionError as e:
-                    logging.error(f"can not access file {path}. Might be opened by another application. "
-                                  f"Error returned: {e}")
-                    raise PermissionError(f"can not access file {path}. Might be opened by another application."
-                                          f"Error returned: {e}")
-                except OSError as e:
-                    logging.error(f"can not access file {path}. Might be opened by another application. "
-                                  f"Error returned: {e}")
-                    raise OSError(f"can not access file {path}. Might be opened by another application."
-                                  f"Error returned: {e}")
-                except UserWarning as e:
-                    logging.debug(f"{path} file empty - {e}")
-                    raise UserWarning(f"can not access file {path}. Might be opened by another application. "
-                                      f"Error returned: {e}")
+                with _safe_open(path, 'wt') as config_file:
+                    config_file.write(default_cfg)
+                content = default_cfg  # parsed directly below, no need to read back written file
+                logging.debug(f'{path} file created')
         # read file
-        try:
-            with open(path, 'rt') as config_file:
-                for line in config_file:
-                    # skip comment or empty lines
-                    if not (line.startswith('#') or line.startswith('\n')):
-                        var_name, var_value = line.split('=')
-                        var_name = var_name.strip(' \t\n\r')
-                        var_value = var_value.strip(' \t\n\r')
-                        if ',' in var_value:
-                            self._config[var_name] = [x.strip(' \t\n\r') for x in var_value.split(',')]
-                        else:
-                            self._config[var_name] = var_value
-            config_file.close()
-            logging.info(f'Configuration file {path} read.')
-            logging.debug('Config file contents:')
-            # log config file content
-            for key in self._config.keys():
-                logging.debug(f"config[{key}] = {self._config[key]}")
-            logging.debug('End of Config file content.')
-        except PermissionError as e:
-            logging.error(f"can not access file {path}. Might be opened by another application. "
-                          f"Error returned: {e}")
-            raise PermissionError(f"can not access file {path}. Might be opened by another application."
-                                  f"Error returned: {e}")
-        except OSError as e:
-            logging.error(f"can not access file {path}. Might be opened by another application. "
-                          f"Error returned: {e}")
-            raise OSError(f"can not access file {path}. Might be opened by another application."
-                          f"Error returned: {e}")
-        except UserWarning as e:
-            logging.debug(f"{path} file empty - {e}")
-            raise UserWarning(f"can not access file {path}. Might be opened by another application. "
-                              f"Error returned: {e}")
+        if content is None:
+            with _safe_open(path, 'rt') as config_file:
+                content = config_file.read()
+        # comment and empty lines do not match, list values split on access
+        for line in content.splitlines():
+            match = CONFIG_LINE_REGEX.fullmatch(line)
+            if match is not None:
+                self._config[match.group(1)] = match.group(2)
+            elif line.strip() and not line.lstrip().startswith('#'):  # neither blank nor comment line
+                logging.warning(f"ignoring config file {split(path)[1]} line not in 'name = value' format: {line}")
+        logging.info(f'Configuration file {path} read.')
+        logging.debug('Config file contents:')
+        # log config file content
+        for key in self._config.keys():
+            logging.debug(f"config[{key}] = {self._config[key]}")
+        logging.debug('End of Config file content.')
         # verify config_version
         file_version = self.__getitem__("config_version")
         fault_msg = f"Config file {split(path)[1]} version ({file_version}) is lower than " \
@@ -305,13 +441,15 @@ class Config:
         @param item: name of parameter
         @return: value of parameter from configuration file
         """
-        assert isinstance(item, str)
         if item in self._config:
             try:
                 ret = self._config[item]
             except KeyError as e:
                 logging.error(f'parameter requested {item} not in config file, error: {e}')
                 return ''
+            if isinstance(ret, str) and ',' in ret:  # first access to list value, split and keep result
+                ret = [x.strip(' \t\n\r') for x in ret.split(',')]
+                self._config[item] = ret
             if isinstance(ret, str) and ret.lower() == 'none':
                 ret = None
             return ret
@@ -337,13 +475,18 @@ class ProgressBar:
     _bar_suffix = '| '
     _empty_fill = ' '
     _fill = '#'
-    progress_before_next = 0
     debug = False
     verbose = False
     quiet = False
 
     _progress = 0  # between 0 and _width -- used as filled portion of progress bar
     _increment = 0  # between 0 and (_max - _min) -- used for X/Y indication right of progress bar
+    _ticks_per_unit = 0  # _width / (_max - _min) -- progress bar characters per increment
+    _redraw_interval_ns = 50_000_000  # minimal time between progress bar redraws, 50 ms
+    _last_draw_ns = 0  # time.monotonic_ns() of last redraw
+    _prefix = ''  # padded title and bar prefix, prebuilt for update
+    _suffix = ''  # '/' and maximal value displayed right of progress bar, prebuilt for update
+    _last_drawn = None  # (filled characters, increment, end character) of last update, skip identical redraws
 
     def __init__(self, text, maximum=10, minimum=0, verbosity_mode=''):
         """ Initialising parsing arguments.
@@ -367,6 +510,9 @@ class ProgressBar:
         self._max = maximum
         self._progress = 0
         self._increment = 0
+        self._ticks_per_unit = self._width / (self._max - self._min)
+        self._last_draw_ns = 0
+        self._build_template()
         # LOGGING PARAMETERS
         assert isinstance(verbosity_mode, str)
         assert verbosity_mode in ['', 'debug', 'verbose', 'quiet']
@@ -399,6 +545,7 @@ class ProgressBar:
         assert isinstance(value, int)
         assert 0 < value < 80
         self._width = value
+        self._ticks_per_unit = self._width / (self._max - self._min)
 
     @property
     def title_width(self):
@@ -414,6 +561,14 @@ class ProgressBar:
         assert isinstance(value, int)
         assert 0 < value < 80
         self._title_width = value
+        self._build_template()
+
+    def _build_template(self):
+        """ Prebuild constant parts of progress bar line. """
+
+        self._prefix = "{:<{}.{}s}{}".format(self._text, self._title_width, self._title_width, self._bar_prefix)
+        self._suffix = '/{}'.format(self._max - self._min)
+        self._last_drawn = None
 
     def next(self, n=1):
         """ Increment progress bar state.
@@ -424,12 +579,10 @@ class ProgressBar:
         assert isinstance(n, int)
         assert n >= 0
         if n > 0:
-            self._progress += 1 / (n * (self._max - self._min) / self._width)
-            if self._progress > self._width:
-                self._progress = self._width
             self._increment += n
-            if float(self._progress) >= self.progress_before_next + 1 / self._width:
-                self.progress_before_next = self._progress
+            now = monotonic_ns()
+            if now - self._last_draw_ns > self._redraw_interval_ns:  # throttle redraws by wall-clock time
+                self._progress = min(self._increment * self._ticks_per_unit, self._width)
                 self.update()
 
     def update(self, end_char='\r'):
@@ -439,13 +592,16 @@ class ProgressBar:
         """
 
         assert isinstance(end_char, str)
-        diff = self._max - self._min
-        bar = self._fill * int(self._progress)
-        empty = self._empty_fill * (self._width - int(self._progress))
         if not self.debug and not self.verbose and not self.quiet:
-            print("{:<{}.{}s}{}{}{}{}{}/{}".format(self._text, self._title_width, self._title_width,
-                                                   self._bar_prefix, bar, empty, self._bar_suffix,
-                                                   str(self._increment), str(diff)), end=end_char)
+            filled = int(self._progress)
+            drawn = (filled, self._increment, end_char)
+            if drawn != self._last_drawn:  # skip redrawing identical line
+                self._last_drawn = drawn
+                self._last_draw_ns = monotonic_ns()
+                bar = self._fill * filled + self._empty_fill * (self._width - filled)
+                sys.stdout.write(''.join((self._prefix, bar, self._bar_suffix, str(self._increment), self._suffix,
+                                          end_char)))
+                sys.stdout.flush()  # affordable now redraws are throttled, shows bar without waiting for newline
 
     def finish(self):
         """ Clean up and release handles. """